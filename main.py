@@ -2,7 +2,10 @@ import csv
 import signal
 import difflib
 import json
+import heapq
+import math
 import os
+import re
 import sys
 import time
 from datetime import datetime
@@ -136,6 +139,105 @@ class DiffHighlighter(QtGui.QSyntaxHighlighter):
                 index = pattern.indexIn(text, index + length)
         self.setCurrentBlockState(0)
 
+# ==================== Índice de Trigramas para Claves ====================
+class KeyTrigramIndex:
+    """
+    Índice de trigramas sobre las claves del CSV para sugerir la clave correcta
+    cuando un marcador de la plantilla no coincide con ninguna (por ejemplo,
+    !@!TEXTO_EMAL!@! en lugar de !@!TEXTO_EMAIL!@!).
+
+    Se construye una sola vez por catálogo, con las claves agrupadas por número de
+    trigramas. En cada consulta se recorren primero los grupos de longitud más parecida
+    al marcador y, dentro de cada grupo, se aplica el filtro por conteo: una clave con
+    puntuación suficiente comparte al menos `min_shared` trigramas con el marcador, así
+    que aparece en alguna de las listas más cortas y basta con recorrer esas. Solo las
+    mejores candidatas se ordenan con difflib.
+    """
+    # Máximo de entradas de las listas de trigramas que se recorren por consulta
+    POSTINGS_BUDGET = 20000
+
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+        self.key_grams = []
+        self.postings = {}
+        for key_id, key in enumerate(self.keys):
+            grams = self.trigrams(key)
+            self.key_grams.append(grams)
+            for gram in grams:
+                self.postings.setdefault((gram, len(grams)), []).append(key_id)
+        self.max_size = max(map(len, self.key_grams), default=0)
+
+    @staticmethod
+    def trigrams(text):
+        """Devuelve el conjunto de trigramas de la clave (con relleno en los bordes)."""
+        padded = f"  {text.upper()} "
+        return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+    def suggest(self, key, limit=3, min_score=0.4):
+        """
+        Devuelve hasta `limit` tuplas (clave, puntuación) ordenadas de mayor a menor
+        similitud. Los candidatos se filtran por coeficiente de Dice sobre trigramas
+        (descartando los inferiores a `min_score`) y se ordenan con difflib.
+        """
+        best = self.search(self.trigrams(key), min_score, limit * 5)
+
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(key.upper())
+        ranked = []
+        for _, key_id in best:
+            matcher.set_seq1(self.keys[key_id].upper())
+            ranked.append((matcher.ratio(), self.keys[key_id]))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        return [(candidate, score) for score, candidate in ranked[:limit]]
+
+    def search(self, grams, min_score, count):
+        """
+        Devuelve hasta `count` tuplas (Dice, id de clave) con Dice >= `min_score`,
+        recorriendo como máximo POSTINGS_BUDGET entradas de las listas de trigramas.
+        """
+        size = len(grams)
+        # Tamaños para los que el coeficiente de Dice puede llegar a min_score
+        min_size = max(1, math.ceil(min_score * size / (2 - min_score)))
+        max_size = min(self.max_size, math.floor((2 - min_score) * size / min_score))
+        sizes = sorted(range(min_size, max_size + 1), key=lambda other: abs(other - size))
+
+        # Montículo con las `count` mejores candidatas; su mínimo sube el umbral
+        best = []
+        threshold = min_score
+        budget = self.POSTINGS_BUDGET
+        for other in sizes:
+            if budget <= 0:
+                break
+            if 2.0 * min(size, other) / (size + other) < threshold:
+                continue
+            # Una clave con Dice >= threshold comparte al menos min_shared trigramas, por
+            # lo que está en alguna de las size - min_shared + 1 listas más cortas. El
+            # umbral sube a medida que se llena el montículo y se recorren menos listas.
+            postings = sorted((self.postings.get((gram, other), []) for gram in grams), key=len)
+            seen = set()
+            scanned = 0
+            min_shared = math.ceil(threshold * (size + other) / 2 - 1e-9)
+            while scanned <= size - min_shared and budget > 0:
+                ids = postings[scanned]
+                scanned += 1
+                budget -= len(ids)
+                for key_id in ids:
+                    if key_id in seen:
+                        continue
+                    seen.add(key_id)
+                    shared = len(grams & self.key_grams[key_id])
+                    if shared < min_shared:
+                        continue
+                    entry = (2.0 * shared / (size + other), key_id)
+                    if len(best) < count:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+                if len(best) == count:
+                    threshold = max(min_score, best[0][0])
+                    min_shared = math.ceil(threshold * (size + other) / 2 - 1e-9)
+        return best
+
 # ==================== Diálogo de Información ====================
 class InfoDialog(QtWidgets.QDialog):
     def __init__(self, parent=None):
@@ -204,6 +306,10 @@ class SettingsDialog(QtWidgets.QDialog):
         h_layout.addWidget(output_btn)
         layout.addRow("Directorio Salida:", h_layout)
         
+        self.fail_unresolved_check = QtWidgets.QCheckBox("Cancelar si hay marcadores sin resolver")
+        self.fail_unresolved_check.setChecked(self.settings.get("fail_on_unresolved", False))
+        layout.addRow(self.fail_unresolved_check)
+        
         button_box = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
         button_box.accepted.connect(self.accept)
         button_box.rejected.connect(self.reject)
@@ -218,6 +324,7 @@ class SettingsDialog(QtWidgets.QDialog):
         self.settings["csv_separator"] = self.sep_edit.text() or ";"
         self.settings["marker_pattern"] = self.marker_edit.text() or "!@![A-Z0-9_]+!@!"
         self.settings["output_dir"] = self.output_dir_edit.text() or os.getcwd()
+        self.settings["fail_on_unresolved"] = self.fail_unresolved_check.isChecked()
         super().accept()
 
 # ==================== Ventana Principal ====================
@@ -232,9 +339,12 @@ class MainWindow(QtWidgets.QMainWindow):
         self.config = {
             "csv_separator": ";",
             "marker_pattern": "!@![A-Z0-9_]+!@!",
-            "output_dir": os.getcwd()
+            "output_dir": os.getcwd(),
+            "fail_on_unresolved": False
         }
         self.history = []  # Lista de registros de generación
+        self.key_index = None  # Índice de trigramas del último catálogo procesado
+        self.key_index_fingerprint = None
         
         self.init_ui()
         self.create_menu()
@@ -375,11 +485,20 @@ class MainWindow(QtWidgets.QMainWindow):
         self.diff_view.setFont(QtGui.QFont("Consolas", 10))
         diff_layout.addWidget(self.diff_view)
         
+        # Editor: Marcadores sin resolver y sugerencias
+        group_unresolved = QtWidgets.QGroupBox("Marcadores sin Resolver")
+        unresolved_layout = QtWidgets.QVBoxLayout(group_unresolved)
+        self.unresolved_view = QtWidgets.QPlainTextEdit()
+        self.unresolved_view.setReadOnly(True)
+        self.unresolved_view.setFont(QtGui.QFont("Consolas", 10))
+        unresolved_layout.addWidget(self.unresolved_view)
+        
         container = QtWidgets.QWidget()
         container_layout = QtWidgets.QVBoxLayout(container)
         container_layout.addWidget(group_orig)
         container_layout.addWidget(group_gen)
         container_layout.addWidget(group_diff)
+        container_layout.addWidget(group_unresolved)
         splitter.addWidget(container)
         
         self.tabs.addTab(self.diff_tab, "Comparación Diff")
@@ -539,13 +658,58 @@ class MainWindow(QtWidgets.QMainWindow):
 
         return languages, translations
 
+    def get_key_index(self, translations):
+        """
+        Devuelve el índice de trigramas de las claves del CSV. Solo se reconstruye
+        cuando cambia el conjunto de claves, no en cada generación.
+        """
+        # Las claves ya tienen su hash calculado por el diccionario, así que la huella
+        # es barata y evita comparar clave a clave con el índice anterior.
+        keys = tuple(translations)
+        fingerprint = (len(keys), hash(keys))
+        if self.key_index is None or self.key_index_fingerprint != fingerprint:
+            self.key_index = KeyTrigramIndex(keys)
+            self.key_index_fingerprint = fingerprint
+        return self.key_index
+
+    def find_unresolved_markers(self, template, translations):
+        """
+        Busca en la plantilla los marcadores cuya clave no existe en el CSV y devuelve
+        un diccionario { marcador: [(clave sugerida, puntuación), ...] }.
+
+        Se usan los mismos delimitadores !@!CLAVE!@! que el reemplazo de
+        generate_and_compare, independientemente del patrón de resaltado.
+        """
+        unresolved = {}
+        for match in re.finditer(r"!@!(.+?)!@!", template):
+            marker, key = match.group(0), match.group(1)
+            if marker not in unresolved and key not in translations:
+                unresolved[marker] = key
+        if not unresolved:
+            return {}
+
+        index = self.get_key_index(translations)
+        return {marker: index.suggest(key) for marker, key in unresolved.items()}
 
+    def format_unresolved_markers(self, unresolved):
+        """Devuelve un texto legible con los marcadores sin resolver y sus sugerencias."""
+        lines = []
+        for marker, suggestions in unresolved.items():
+            if suggestions:
+                hints = ", ".join(f"{key} ({score:.0%})" for key, score in suggestions)
+                lines.append(f"{marker} -> ¿Quizás: {hints}?")
+            else:
+                lines.append(f"{marker} -> sin sugerencias")
+        return "\n".join(lines)
     
     def generate_and_compare(self):
         """
         Genera la salida reemplazando marcadores en la plantilla según las traducciones
         del CSV. Si se marca “Bulk”, genera para todos los idiomas.
         Actualiza la pestaña Diff y guarda en el historial.
+
+        Los marcadores sin clave en el CSV se listan con sugerencias; si está activado
+        "fail_on_unresolved" se cancela la generación de archivos.
         """
         template = self.html_editor.toPlainText()
         csv_text = self.csv_editor.toPlainText()
@@ -566,6 +730,23 @@ class MainWindow(QtWidgets.QMainWindow):
             self.lang_combo.clear()
             self.lang_combo.addItems(languages)
 
+        unresolved = self.find_unresolved_markers(template, translations)
+        unresolved_text = self.format_unresolved_markers(unresolved)
+        self.unresolved_view.setPlainText(unresolved_text or "Todos los marcadores tienen traducción.")
+        if unresolved and self.config.get("fail_on_unresolved", False):
+            # Sustituir la comparación anterior para no mostrarla junto a este error
+            self.diff_original.setPlainText(template)
+            self.diff_generated.setPlainText("No se ha generado ninguna salida (marcadores sin resolver).")
+            self.diff_view.clear()
+            self.tabs.setCurrentWidget(self.diff_tab)
+            QtWidgets.QMessageBox.critical(
+                self,
+                "Marcadores sin resolver",
+                f"Se han encontrado {len(unresolved)} marcador(es) sin clave en el CSV. "
+                f"No se ha generado ningún archivo.\n\n{unresolved_text}"
+            )
+            return
+
         results = {}  # Almacena salida para cada idioma generado
         if self.bulk_check.isChecked():
             langs_to_generate = languages
@@ -620,6 +801,7 @@ class MainWindow(QtWidgets.QMainWindow):
         hist_entry = {
             "timestamp": now,
             "idiomas": langs_to_generate,
+            "sin_resolver": list(unresolved),
             "output_dir": self.config.get("output_dir", os.getcwd())
         }
         self.history.append(hist_entry)
@@ -639,6 +821,14 @@ class MainWindow(QtWidgets.QMainWindow):
                 errors.append(f"{filename}: {e}")
         if errors:
             QtWidgets.QMessageBox.critical(self, "Errores al generar archivos", "\n".join(errors))
+        elif unresolved:
+            QtWidgets.QMessageBox.warning(
+                self,
+                "Generación con marcadores sin resolver",
+                f"Archivos generados en:\n{output_dir}\n\n"
+                f"{len(unresolved)} marcador(es) sin clave en el CSV:\n{unresolved_text}"
+            )
+            self.statusBar().showMessage(f"Proceso completado con {len(unresolved)} marcador(es) sin resolver.", 5000)
         else:
             QtWidgets.QMessageBox.information(self, "Generación exitosa", f"Archivos generados en:\n{output_dir}")
             self.statusBar().showMessage("Proceso completado.", 5000)
@@ -649,6 +839,8 @@ class MainWindow(QtWidgets.QMainWindow):
         lines = []
         for entry in self.history:
             line = f"{entry['timestamp']} - Idiomas: {', '.join(entry['idiomas'])} - Salida: {entry['output_dir']}"
+            if entry.get("sin_resolver"):
+                line += f" - Sin resolver: {', '.join(entry['sin_resolver'])}"
             lines.append(line)
         self.history_view.setPlainText("\n".join(lines))
 